@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Building the static assets of the dashboards
+# The style sheets, scripts and logos of each dashboard are kept in `<dashboard>/assets_src/`.
+# This script writes the files served by Dash into `<dashboard>/assets/`:
+#
+# * `.css` files are minified and the `url(...)` references are updated to the fingerprinted names
+# * every file gets the hash of its content in the name, e.g. `Logo_SA.png` ==> `Logo_SA.1a2b3c4d5e.png`
+# * text files (`.css`, `.js`, `.svg`) get precompressed `.br` (if Brotli is installed) and `.gz` copies
+# * `assets/manifest.json` maps the source names to the fingerprinted names (used by the apps)
+# * `fingerprinted_assets.py` (serving these files) is copied next to the app.py of each dashboard
+#
+# A fingerprinted file never changes, so the apps send it with a far-future cache header. The build is
+# reproducible: running it again without changes in assets_src/ leaves assets/ as it is.
+#
+# Usage:
+#     python build_assets.py          ==> build assets/ from assets_src/ (no network needed)
+#     python build_assets.py --fetch  ==> download the vendored style sheets (and their fonts) first
+
+import os
+import re
+import sys
+import gzip
+import json
+import hashlib
+import urllib.request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Dashboards and the third-party files vendored into their assets_src/
+VENDOR_SOURCES = {
+    "dash_app_covid_worldwide": {
+        # Sketchy theme of Bootswatch 4 (dbc.themes.SKETCHY), --fetch also vendors its Google fonts (OFL)
+        # into assets_src/fonts/, until then they are @import-ed from fonts.googleapis.com
+        "bootstrap-sketchy.css": "https://cdn.jsdelivr.net/npm/bootswatch@4.6.1/dist/sketchy/bootstrap.css"},
+    "dash_app_iris_data": {
+        "bWLwgP.css": "https://codepen.io/chriddyp/pen/bWLwgP.css"}}
+
+# Modules shared by the dashboards, copied into each dashboard folder
+SHARED_MODULES = ["fingerprinted_assets.py"]
+GENERATED_HEADER = "# Generated by build_assets.py from {0} at the root of the repository, edit that file instead.\n"
+
+COMPRESSED_EXTENSIONS = (".css", ".js", ".svg")
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{10}\.\w+(\.br|\.gz)?$")
+CSS_URL = re.compile(r"""url\((['"]?)([^)'"]+)\1\)""")
+CSS_IMPORT = re.compile(r"""@import\s+url\((['"]?)(https?://[^)'"]+)\1\)\s*;""")
+CSS_STRING = re.compile(r"""("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')""")
+
+#############################################################################################################
+def download(url):
+    # fonts.googleapis.com sends woff2 fonts only to the browsers it knows
+    request = urllib.request.Request(url, headers={"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) "
+                                                                 "AppleWebKit/537.36 Chrome/85.0 Safari/537.36"})
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+def fetch_vendor_sources(dashboard, sources):
+    """
+    Downloads the style sheets into assets_src/, @import-ed remote style sheets (e.g. Google fonts)
+    are inlined and the fonts they use are saved in assets_src/fonts/
+    """
+    source_folder = os.path.join(ROOT, dashboard, "assets_src")
+    for name, url in sources.items():
+        print("Fetching {} ==> {}/assets_src/{}".format(url, dashboard, name))
+        css = download(url).decode("utf-8")
+
+        def inline_import(match):
+            imported = download(match.group(2)).decode("utf-8")
+            def vendor_font(font_match):
+                font_url = font_match.group(2)
+                if not font_url.startswith("http"):
+                    return font_match.group(0)
+                font_name = os.path.basename(font_url.split("?")[0])
+                os.makedirs(os.path.join(source_folder, "fonts"), exist_ok=True)
+                with open(os.path.join(source_folder, "fonts", font_name), "wb") as font_file:
+                    font_file.write(download(font_url))
+                return "url(fonts/{})".format(font_name)
+            return CSS_URL.sub(vendor_font, imported)
+
+        css = CSS_IMPORT.sub(inline_import, css)
+        with open(os.path.join(source_folder, name), "w", encoding="utf-8") as css_file:
+            css_file.write(css)
+
+#############################################################################################################
+def minify_css(css):
+    """
+    Removes the comments and the whitespace that doesn't change the meaning of the style sheet,
+    quoted strings (e.g. SVG data URIs) are kept as they are
+    """
+    parts = CSS_STRING.split(re.sub(r"/\*.*?\*/", "", css, flags=re.S))
+    for i in range(0, len(parts), 2): # strings are at the odd positions
+        part = re.sub(r"\s+", " ", parts[i])
+        part = re.sub(r"\s*([{};,])\s*", r"\1", part)
+        parts[i] = re.sub(r":\s+", ":", part).replace(";}", "}")
+    return "".join(parts).strip()
+
+def fingerprinted_name(name, content):
+    stem, extension = os.path.splitext(name)
+    return "{}.{}{}".format(stem, hashlib.sha1(content).hexdigest()[:10], extension)
+
+def build_dashboard(dashboard):
+    source_folder = os.path.join(ROOT, dashboard, "assets_src")
+    assets_folder = os.path.join(ROOT, dashboard, "assets")
+    os.makedirs(assets_folder, exist_ok=True)
+
+    sources = sorted(os.path.relpath(os.path.join(folder, file_name), source_folder).replace(os.sep, "/")
+                     for folder, _, file_names in os.walk(source_folder) for file_name in file_names)
+    # Style sheets last, they need the fingerprinted names of the fonts/images they use
+    sources.sort(key=lambda name: name.endswith(".css"))
+
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(source_folder, name), "rb") as source_file:
+            content = source_file.read()
+        if name.endswith(".css"):
+            css = CSS_URL.sub(lambda match: "url({0}{1}{0})".format(
+                match.group(1), manifest.get(match.group(2), match.group(2))), content.decode("utf-8"))
+            content = minify_css(css).encode("utf-8")
+        manifest[name] = fingerprinted_name(name, content)
+
+        target = os.path.join(assets_folder, manifest[name])
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, "wb") as target_file:
+            target_file.write(content)
+        if name.endswith(COMPRESSED_EXTENSIONS):
+            with open(target + ".gz", "wb") as target_file:
+                target_file.write(gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + ".br", "wb") as target_file:
+                    target_file.write(brotli.compress(content))
+
+    # Removing the outputs of the previous builds
+    current = set(manifest.values())
+    for folder, _, file_names in os.walk(assets_folder):
+        for file_name in file_names:
+            path = os.path.relpath(os.path.join(folder, file_name), assets_folder).replace(os.sep, "/")
+            if FINGERPRINTED.search(path) and re.sub(r"\.(br|gz)$", "", path) not in current:
+                os.remove(os.path.join(folder, file_name))
+
+    with open(os.path.join(assets_folder, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+
+    for module in SHARED_MODULES:
+        with open(os.path.join(ROOT, module), encoding="utf-8") as module_file:
+            lines = module_file.readlines()
+        # Header after the shebang and coding lines
+        with open(os.path.join(ROOT, dashboard, module), "w", encoding="utf-8") as module_file:
+            module_file.writelines(lines[:2] + [GENERATED_HEADER.format(module)] + lines[2:])
+    print("{}: {} assets built{}".format(dashboard, len(manifest), "" if brotli else " (no Brotli installed)"))
+
+#############################################################################################################
+if __name__ == "__main__":
+    for dashboard in VENDOR_SOURCES:
+        if "--fetch" in sys.argv:
+            fetch_vendor_sources(dashboard, VENDOR_SOURCES[dashboard])
+        build_dashboard(dashboard)
@@ -12,17 +12,31 @@
 # In[1]:
 
 
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
 import pandas as pd
 import numpy as np
 from datetime import datetime
+import plotly
 import plotly.graph_objects as go
+from urllib.parse import urlencode
+from flask import jsonify, request, Response, stream_with_context
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, ClientsideFunction
 #import dash_table
 import dash_bootstrap_components as dbc
+from fingerprinted_assets import serve_fingerprinted_assets
 
 
 # In[2]:
@@ -30,12 +44,17 @@ import dash_bootstrap_components as dbc
 
 ################################################################################################################
 # initializing dash app
-external_stylesheets = [dbc.themes.SKETCHY]#YETI]#CYBORG]#CERULEAN]#LUMEN]
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# The Sketchy theme (dbc.themes.SKETCHY) is vendored in assets_src/ and loaded by Dash from assets/
+app = dash.Dash(__name__)
 server = app.server
-# More Style Sheets from Dash Bootstrap Components:
+# The /debug/... routes (internal sizes and counts) are only added with DASH_DEBUG_ROUTES=1
+debug_routes = os.environ.get("DASH_DEBUG_ROUTES") == "1"
+# More Style Sheets from Dash Bootstrap Components (vendor one with build_assets.py):
 #https://dash-bootstrap-components.opensource.faculty.ai/docs/themes/
 
+# Self-hosted assets, see ../build_assets.py, asset_url("Logo_SA.png") ==> URL of "Logo_SA.9b28b1810c.png"
+asset_url = serve_fingerprinted_assets(app)
+
 
 # In[3]:
 
@@ -141,7 +160,7 @@ available_countries=data[3]
 comp_1_title_logo = dbc.Row([
     dbc.Col(html.H1(children='CoVID19 Trends Worldwide'),
             className=["mt-4","mb-2"]), #margin top/bottom/left/right-# size (0->5 & auto)
-    dbc.Col(html.A([html.Img(src='/assets/Logo_SA.png',
+    dbc.Col(html.A([html.Img(src=asset_url('Logo_SA.png'),
                              style={'width' : '40%',
                                     'float' : 'right',
                                     'position' : 'relative',
@@ -194,72 +213,70 @@ comp_4_dropdown_for_cases_or_deaths = dcc.Dropdown(
 # **Task 1:** <br>
 # *Get the daily reported numbers by continent*
 #
-# * To get the daily reported number by continent, we need to perform following steps:
-#
-#     * 1: group by continent and date ==> `grooupby(["continentExp", "date"])`
-#     * 2: compute sum on grouped data ==> `.sum()`
-#     * 3: good to reorder by ascending dates ==> `.sort_values(["date"], ascending = True)`
+# * Instead of re-grouping and pivoting the whole table in every callback, we build a (date x continent) store once:
 #
+#     * 1: group by continent and date and sum ==> `groupby(["continentExp", "date"]).sum()`
+#     * 2: unstack the continents to columns, one numpy array (date x continent) for each column
+#     * 3: the date axis is sorted, so any day is a direct row lookup and a date range is a row slice
+#     * 4: cumulative sums are computed once along the date axis
 #
+# * Last updated day is simply the last row, no `tail(5)` so it works for any number of continents.
 
 # In[8]:
 
 
-# Creating a function to get the daily reported numbers by continent
-def daily_reported_nums_continent(data):
+class ContinentDateStore:
     """
-    data = the dataframe df we have after some cleaning
-    Output will be after following steps:
-        1: group by continent and date ==> grooupby(["continentExp", "date"])
-        2: compute sum on grouped data ==> .sum()
-        3: good to reorder by ascending dates ==> .sort_values(["date"], ascending = True)
+    Daily reported numbers aggregated by continent and date.
+        dates      = sorted DatetimeIndex (rows)
+        continents = Index of continent names (columns)
+        daily[column]   = numpy array (date x continent), NaN when nothing was reported on that day
+        running[column] = cumulative sum along the dates (NaN counted as 0)
     """
-    daily_sum_continent = data.groupby(["continentExp","date"]).sum()
-    daily_sum_continent = daily_sum_continent.sort_values(["date"], ascending = True)
-    return daily_sum_continent
-df_daily_reported_sum = daily_reported_nums_continent(df)
-
-
-# In[9]:
-
-
-# daily sum of reported numbers by continent in sorted order by date
-#df2 = df.groupby(['continentExp','date']).sum().sort_values(['date'], ascending = True)
-#daily_sum_continent = df.groupby(['continentExp','date']).sum().sort_values(['date'], ascending = True)
-
-
-# **Task:** <br>
-# *Get the total reported numbers on the last updated day with respect to continents.*
-# * We have the daily reported number from `daily_reported_nums_continent()` by continent in sorted by `date`. Grab the `tail(5)` --  as we have 5 continents in the data --  and `reset_index()` to get `continentExp` and `date` columns.
-
-# In[10]:
-
-
-# last day sum of reported numbers by continent
-#df3 = df.groupby(['continentExp','date']).sum().sort_values(['date'], ascending = True).tail(5).reset_index()
-def last_day_total_nums_continent(data):
-    last_day_sum_continent = daily_reported_nums_continent(data) # function call with in the function
-    last_day_sum_continent = last_day_sum_continent.tail(5).reset_index()
-    return last_day_sum_continent
-
-df_last_day_sum_continent = last_day_total_nums_continent(df)
-
-
-# **Task:** *Total reported numbers by continent since last update*
-# * simply group the data by continent and get the sum ==> `df.groupby(['continentExp']).sum()`
-
-# In[11]:
-
-
-# total number reported by continent till last update
-#df4 = df.groupby(['continentExp']).sum() # total number since the start date of data
-def total_nums_reported_by_continent(data):
-    """
-    Simply group the data by continent and get the sum
-    """
-    return data.groupby(["continentExp"]).sum()
+    def __init__(self, data, columns=("cases", "deaths", "Cases Per Million", "Deaths Per Million")):
+        grouped = data.groupby(["continentExp", "date"])[list(columns)].sum()
+        self.dates = grouped.index.get_level_values("date").unique().sort_values()
+        self.continents = grouped.index.get_level_values("continentExp").unique().sort_values()
+        self.daily = {}
+        self.running = {}
+        for column in columns:
+            values = grouped[column].unstack("continentExp").reindex(index=self.dates,
+                                                                      columns=self.continents).values
+            self.daily[column] = values
+            self.running[column] = np.nancumsum(values, axis=0)
+
+    def position(self, date):
+        """Row of the given date on the date axis (hash lookup)"""
+        return self.dates.get_loc(pd.Timestamp(date))
+
+    def day(self, column, date):
+        """Reported numbers by continent on the given date"""
+        return pd.Series(self.daily[column][self.position(date)], index=self.continents)
+
+    def last_day(self, column):
+        """Reported numbers by continent on the last updated day"""
+        return pd.Series(self.daily[column][-1], index=self.continents)
+
+    def total(self, column):
+        """Total reported numbers by continent since the start date"""
+        return pd.Series(self.running[column][-1], index=self.continents)
+
+    def range(self, column, start, end, cumulative=False):
+        """(date x continent) DataFrame for start <= date <= end (binary search on the sorted dates)"""
+        rows = self.dates.slice_indexer(pd.Timestamp(start), pd.Timestamp(end))
+        return self.frame(column, cumulative)[rows]
+
+    def frame(self, column, cumulative=False):
+        """
+        (date x continent) DataFrame of the daily numbers or their cumulative sum,
+        cumulative sum is kept NaN on the days with nothing reported (gaps in the line plots)
+        """
+        values = self.daily[column]
+        if cumulative:
+            values = np.where(np.isnan(values), np.nan, self.running[column])
+        return pd.DataFrame(values, index=self.dates, columns=self.continents)
 
-df_total_reported_by_continent = total_nums_reported_by_continent(df)
+continent_store = ContinentDateStore(df)
 
 
 # **`Main header` and the titles for pie charts by continent**
@@ -313,8 +330,9 @@ comp_7_pie_charts = dbc.Row([
 def pie_charts_by_continents(choice_top_dropdown_cases_deaths_column):
 
     # 1st Output
-    fig1 = go.Figure(data=[go.Pie(labels=df_last_day_sum_continent['continentExp'],
-                                 values=df_last_day_sum_continent[choice_top_dropdown_cases_deaths_column])])
+    last_day = continent_store.last_day(choice_top_dropdown_cases_deaths_column).fillna(0)
+    fig1 = go.Figure(data=[go.Pie(labels=last_day.index,
+                                  values=last_day.values)])
     # Updating Figure Layout
     fig1.update_layout(paper_bgcolor='rgba(0,0,0,0.05)',#'white' #rgba => rgb colors, with alpha/opacity (0-1)
                        plot_bgcolor='rgba(0,0,0,0.05)',
@@ -322,8 +340,9 @@ def pie_charts_by_continents(choice_top_dropdown_cases_deaths_column):
                        margin=dict(l=30,r=30,t=30,b=30))#,pad=10))
 
     # 2nd Output
-    fig2 = go.Figure(data=[go.Pie(labels=df_total_reported_by_continent.index,
-                                  values=df_total_reported_by_continent[choice_top_dropdown_cases_deaths_column])])
+    total = continent_store.total(choice_top_dropdown_cases_deaths_column)
+    fig2 = go.Figure(data=[go.Pie(labels=total.index,
+                                  values=total.values)])
     # Updating Figure Layout
     fig2.update_layout(paper_bgcolor='rgba(0,0,0,0.05)',
                        plot_bgcolor='rgba(0,0,0,0.05)',
@@ -368,32 +387,7 @@ comp_9_sub_titles_for_line_plots_continents = dbc.Row([
 
 # **`Line plots by continent` along with the callbacks**
 #
-# **Need to do some data manipulation**
-
-# In[15]:
-
-
-# Cumulative sum of cases and/or deaths
-def cum_sum_continent(data):
-    """
-    function returns the dataframe with cumulative sum by continent
-    steps:
-        group by continent & date then sum
-        reset the index to get continent and date column
-        group the data again on continent and get cumulative sum on cases and deaths
-        """
-    continent_cumsum = data.groupby(["continentExp","date"]).sum()
-    continent_cumsum = continent_cumsum.reset_index()
-    continent_cumsum["Cases Per Million"] = continent_cumsum.groupby(["continentExp"]
-                                                                    )["Cases Per Million"].apply(
-        lambda x: x.cumsum())
-    continent_cumsum["Deaths Per Million"] = continent_cumsum.groupby(["continentExp"]
-                                                                     )["Deaths Per Million"].apply(
-        lambda x: x.cumsum())
-    return continent_cumsum
-
-df_cumsum_continent = cum_sum_continent(df)
-
+# * Daily numbers and the cumulative sums both come from `continent_store` (In[8]), no pivot tables needed.
 
 # In[16]:
 
@@ -414,10 +408,7 @@ comp_10_line_plots_continents = dbc.Row([
      Output('line_continent_daily_cumsum', 'figure')],
     [Input('choice_top_dropdown_cases_deaths_column', 'value')])
 def line_plots_by_continents(choice_top_dropdown_cases_deaths_column):
-    df_daily_reported_sum_pivoted = pd.pivot_table(df_daily_reported_sum,#dff,
-                         values=choice_top_dropdown_cases_deaths_column,
-                         index=['date'],
-                         columns='continentExp')
+    df_daily_reported_sum_pivoted = continent_store.frame(choice_top_dropdown_cases_deaths_column)
 
     ##############################--Pie plot for daily reported numbers by continent--###########################
     fig1 = go.Figure()
@@ -434,10 +425,7 @@ def line_plots_by_continents(choice_top_dropdown_cases_deaths_column):
                        margin=dict(l=30,r=30,t=30,b=30))
 
     ##############################--Pie plot:CUMSUM of reported numbers by continent--###########################
-    df_cumsum_pivoted = pd.pivot_table(df_cumsum_continent,#dff2,
-                          values=choice_top_dropdown_cases_deaths_column,
-                          index=['date'],
-                          columns='continentExp')
+    df_cumsum_pivoted = continent_store.frame(choice_top_dropdown_cases_deaths_column, cumulative=True)
 
     fig2 = go.Figure()
     for col in df_cumsum_pivoted.columns:
@@ -487,6 +475,156 @@ comp_12_dropdown_country_selection = dcc.Dropdown(
     style={'width': '70%', 'margin-left': '5px'})
 
 
+# **Cache for the country selections**
+# * The same selections (e.g. the default Gulf states) come again and again from different users, but every
+#   gunicorn worker would compute them on its own and forget them on restart.
+# * The figures are kept in a small SQLite file shared by all the workers on the machine, key is
+#   (column, sorted list of countries, data version), least recently used entries are removed first.
+# * Hits, misses and evictions are available on `/debug/cache` (with DASH_DEBUG_ROUTES=1) to tune the size.
+
+# In[ ]:
+
+
+class PersistentLRUCache:
+    """
+    On-disk LRU cache (SQLite) shared by all the processes using the same file.
+    Bounded by max_entries and max_bytes (size of the stored values).
+    Lookups only read the file: the hit/miss counts and the last use of the entries are kept
+    in the process and written every flush_interval seconds, and the callbacks never wait more
+    than timeout seconds for the file (a locked file counts as a miss / the value is not stored).
+    When the file can't be opened (e.g. unwritable folder), the cache is off: every lookup is a miss.
+    """
+    def __init__(self, path, max_entries=500, max_bytes=50 * 1024 * 1024, timeout=0.1, flush_interval=5.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = {"hits": 0, "misses": 0}
+        self.pending_last_used = {} # key ==> time of the last hit
+        self.last_flush = time.time()
+        self.error = None # set when the cache is off
+        try:
+            with self.connect(timeout=10) as connection:
+                # Readers (SELECT only) don't wait for the writer and don't block it
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("CREATE TABLE IF NOT EXISTS entries "
+                                   "(key TEXT PRIMARY KEY, value TEXT, size INTEGER, last_used REAL)")
+                connection.execute("CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, count INTEGER)")
+                connection.executemany("INSERT OR IGNORE INTO stats VALUES (?, 0)",
+                                       [("hits",), ("misses",), ("evictions",)])
+        except sqlite3.Error as error:
+            self.error = "{}: {}".format(path, error)
+            print("Country figures cache is off ({})".format(self.error))
+
+    @contextmanager
+    def connect(self, timeout=None):
+        """Connection committed (or rolled back on error) and closed at the end of the with block"""
+        connection = sqlite3.connect(self.path, timeout=self.timeout if timeout is None else timeout)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def count(self, connection, name, number=1):
+        connection.execute("UPDATE stats SET count = count + ? WHERE name = ?", (number, name))
+
+    def get(self, key):
+        """Returns the stored value or None, errors (e.g. locked file) count as a miss"""
+        if self.error is not None:
+            return None
+        try:
+            with self.connect() as connection:
+                row = connection.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            row = None
+        with self.lock:
+            if row is None:
+                self.pending["misses"] += 1
+            else:
+                self.pending["hits"] += 1
+                self.pending_last_used[key] = time.time()
+        self.flush()
+        return None if row is None else row[0]
+
+    def flush(self, force=False):
+        """Writes the counts and the last use of the entries (every flush_interval seconds)"""
+        with self.lock:
+            if not force and time.time() - self.last_flush < self.flush_interval:
+                return
+            pending, last_used = self.pending, self.pending_last_used
+            self.pending, self.pending_last_used = {"hits": 0, "misses": 0}, {}
+            self.last_flush = time.time()
+        try:
+            with self.connect() as connection:
+                for name, number in pending.items():
+                    self.count(connection, name, number)
+                connection.executemany("UPDATE entries SET last_used = MAX(last_used, ?) WHERE key = ?",
+                                       [(used, key) for key, used in last_used.items()])
+        except sqlite3.Error:
+            # File is busy, trying again with the next flush
+            with self.lock:
+                for name, number in pending.items():
+                    self.pending[name] += number
+                for key, used in last_used.items():
+                    self.pending_last_used[key] = max(used, self.pending_last_used.get(key, used))
+
+    def set(self, key, value):
+        # A value bigger than the whole cache would only evict everything else
+        if self.error is not None or len(value) > self.max_bytes:
+            return
+        try:
+            with self.connect() as connection:
+                connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                                   (key, value, len(value), time.time()))
+                # Removing the least recently used entries until both limits are met
+                evicted = 0
+                while True:
+                    entries, size = connection.execute(
+                        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                    if entries <= self.max_entries and size <= self.max_bytes:
+                        break
+                    connection.execute("DELETE FROM entries WHERE key = "
+                                       "(SELECT key FROM entries ORDER BY last_used LIMIT 1)")
+                    evicted += 1
+                self.count(connection, "evictions", evicted)
+        except sqlite3.Error:
+            pass
+
+    def stats(self):
+        """Counts and size of the cache, {"error": ...} when the cache is off or the file is busy"""
+        if self.error is not None:
+            return {"error": self.error}
+        self.flush(force=True)
+        try:
+            with self.connect(timeout=10) as connection:
+                stats = dict(connection.execute("SELECT name, count FROM stats").fetchall())
+                stats["entries"], stats["bytes"] = connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        except sqlite3.Error as error:
+            return {"error": str(error)}
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else None
+        stats["max_entries"], stats["max_bytes"] = self.max_entries, self.max_bytes
+        return stats
+
+country_figures_cache = PersistentLRUCache(
+    os.environ.get("COVID_CACHE_PATH", os.path.join(tempfile.gettempdir(), "covid_dash_cache.sqlite")),
+    max_entries=int(os.environ.get("COVID_CACHE_MAX_ENTRIES", 500)),
+    max_bytes=int(os.environ.get("COVID_CACHE_MAX_BYTES", 50 * 1024 * 1024)))
+
+# Data version, cached figures of older data are never used (and go away with LRU)
+data_version = hashlib.sha1(pd.util.hash_pandas_object(
+    df[["countriesAndTerritories", "Cases Per Million", "Deaths Per Million"]]).values).hexdigest()
+
+if debug_routes:
+    @server.route("/debug/cache")
+    def debug_cache():
+        return jsonify(country_figures_cache.stats())
+
+
 # **`Titles and line plots` comparing selected countries.**
 
 # In[19]:
@@ -523,6 +661,17 @@ comp_16_country_cumsum_line_plot = dcc.Graph(
     [Input("choice_top_dropdown_cases_deaths_column", "value"),
      Input("countries", "value")])
 def line_plots_by_countries(choice_top_dropdown_cases_deaths_column, countries_name):
+    # Same countries in any order ==> same figures (pivot table columns are sorted anyway)
+    key = json.dumps([choice_top_dropdown_cases_deaths_column, sorted(set(countries_name or [])), data_version])
+    cached = country_figures_cache.get(key)
+    if cached is not None:
+        return json.loads(cached)
+
+    fig1, fig2 = country_line_plots(choice_top_dropdown_cases_deaths_column, countries_name or [])
+    country_figures_cache.set(key, json.dumps([fig1, fig2], cls=plotly.utils.PlotlyJSONEncoder))
+    return fig1, fig2
+
+def country_line_plots(choice_top_dropdown_cases_deaths_column, countries_name):
     # data selection based on the country selection in dropdown comp_12*
     df_country_select = df[df.countriesAndTerritories.isin(countries_name)]
 
@@ -580,8 +729,271 @@ def line_plots_by_countries(choice_top_dropdown_cases_deaths_column, countries_n
     return fig1, fig2
 
 
+# **`Download` of the rows behind the country plots (CSV or Parquet)**
+# * The file is streamed from `app.server` one country at a time, so the whole export is never
+#   built in memory as one string, even when all the countries are selected.
+# * A download holds its worker thread until the client has received everything, so gunicorn runs threaded
+#   workers (`--worker-class gthread --threads 4` in the Procfile), a slow client doesn't block the others.
+# * Parquet needs `pyarrow`, CSV is always available.
+
+# In[ ]:
+
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# Rows of each country in df, computed only once
+country_row_positions = df.groupby("countriesAndTerritories").indices
+
+export_columns = ["countriesAndTerritories", "countryterritoryCode", "continentExp", "cases", "deaths"]
+
+def export_chunks(column, countries_name):
+    """
+    Yields one DataFrame for each selected country with the date, country info,
+    the selected column and its cumulative sum (CUMSUM).
+    Nothing selected (or only unknown countries) ==> one empty DataFrame with the same columns,
+    so the CSV still has its header row and the Parquet file is a valid (empty) file.
+    """
+    rows = [country_row_positions[country_name] for country_name in countries_name
+            if country_name in country_row_positions]
+    for positions in rows or [np.array([], dtype=int)]:
+        yield export_frame(column, positions)
+
+def export_frame(column, positions):
+    chunk = df.iloc[positions][export_columns + [column]]
+    chunk = chunk.reset_index()
+    chunk["Cumulative " + column] = chunk[column].cumsum()
+    return chunk
+
+def export_schema(column):
+    """Parquet schema from one row of the data, empty columns would have no type otherwise"""
+    return pa.Schema.from_pandas(export_frame(column, [0]), preserve_index=False)
+
+def stream_csv(chunks):
+    first = True
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=first)
+        first = False
+
+class ParquetStreamSink:
+    """
+    Minimal file object for pyarrow's ParquetWriter, the written bytes are
+    collected and handed over (drained) after every row group.
+    """
+    def __init__(self):
+        self.buffers = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffers.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.buffers)
+        self.buffers = []
+        return data
+
+def stream_parquet(chunks, schema):
+    sink = ParquetStreamSink()
+    writer = pq.ParquetWriter(sink, schema)
+    for chunk in chunks:
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False)) # one row group per country
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+@server.route("/export")
+def export_selection():
+    column = request.args.get("metric", "Cases Per Million")
+    file_format = request.args.get("format", "csv")
+    countries_name = request.args.getlist("country")
+    if column not in ["Cases Per Million", "Deaths Per Million"]:
+        return Response("Unknown metric: {}".format(column), status=400)
+    if file_format == "parquet" and pa is None:
+        return Response("Parquet export needs pyarrow, please use CSV.", status=501)
+
+    chunks = export_chunks(column, countries_name)
+    if file_format == "parquet":
+        body, mimetype = stream_parquet(chunks, export_schema(column)), "application/octet-stream"
+    else:
+        file_format, body, mimetype = "csv", stream_csv(chunks), "text/csv"
+    file_name = "covid19_{}.{}".format(column.replace(" ", "_").lower(), file_format)
+    return Response(stream_with_context(body),
+                    mimetype=mimetype,
+                    headers={"Content-Disposition": "attachment; filename={}".format(file_name)})
+
+
+# In[ ]:
+
+
+# 20: Adding a row with the download format and link for the selected countries
+comp_20_export_selection = dbc.Row([
+    dbc.Col(dcc.Dropdown(
+        id="export_format",
+        options=[{"label": "CSV", "value": "csv"},
+                 {"label": "Parquet", "value": "parquet", "disabled": pa is None}],
+        value="csv",
+        clearable=False),
+            width=2,
+            className=["mt-2","mb-2"]),
+    dbc.Col(html.A("Download the selected countries",
+                   id="export_link",
+                   href="",
+                   className="btn btn-dark"),
+            className=["mt-2","mb-2"])])
+
+@app.callback(
+    Output("export_link", "href"),
+    [Input("choice_top_dropdown_cases_deaths_column", "value"),
+     Input("countries", "value"),
+     Input("export_format", "value")])
+def export_link_for_selection(choice_top_dropdown_cases_deaths_column, countries_name, export_format):
+    # relative path, the app may be mounted under a prefix (see ../host.py)
+    return app.get_relative_path("/export") + "?" + urlencode(
+        {"metric": choice_top_dropdown_cases_deaths_column,
+         "format": export_format,
+         "country": countries_name or []},
+        doseq=True)
+
+
 # *************
 # ### BLOCK 5
+# * World map (choropleth) of the selected metric with a date slider
+#
+# **`Main header` for the world map**
+
+# In[ ]:
+
+
+# 18: Adding a row for the main header for the world map
+comp_18_main_header_choropleth = dbc.Row([
+    dbc.Col(dbc.Card(html.H3(
+        children='Daily Reported Numbers on World Map (Per Million Individuals)',
+        className="text-center text-light bg-dark"),
+                     body=True,
+                     color="dark"),
+            className=["mt-2","mb-2"])])
+
+
+# **Need to do some data manipulation for the animation**
+# * The (date x country) matrix of the selected metric is computed only once, at startup.
+# * Sending one full frame for each of the several hundred days would make a huge figure, so the frames are
+#   quantized to integers (2 decimals) and only the values that changed from the previous day are sent.
+#   The full frames are rebuilt in the browser by `assets/choropleth.js`.
+
+# In[ ]:
+
+
+# Scale used to quantize the per million values, 100 ==> 2 decimals
+CHOROPLETH_SCALE = 100
+
+def choropleth_value_matrix(data, column):
+    """
+    Returns (dates, locations, matrix) for the given column,
+    matrix is a numpy array with one row per date and one column per ISO3 country code (NaN == not reported)
+    """
+    data = data[data["countryterritoryCode"] != "NMB"]
+    matrix = pd.pivot_table(data,
+                            values=column,
+                            index=["date"],
+                            columns="countryterritoryCode")
+    dates = [d.strftime("%Y-%m-%d") for d in matrix.index]
+    return dates, list(matrix.columns), matrix.values
+
+def delta_encode_frames(matrix, scale=CHOROPLETH_SCALE):
+    """
+    Quantize the matrix to integers and keep only the changes between consecutive days.
+    Output is: (keyframe, deltas)
+        keyframe = full list of values for the first date
+        deltas = for every next date, [changed column positions, new values]
+    Missing values are sent as None (null in JSON).
+    """
+    quantized = np.round(matrix * scale)
+    missing = np.isnan(quantized)
+
+    def to_list(values):
+        return [None if np.isnan(v) else int(v) for v in values]
+
+    keyframe = to_list(quantized[0])
+    deltas = []
+    for i in range(1, len(quantized)):
+        changed = ~((quantized[i] == quantized[i-1]) | (missing[i] & missing[i-1]))
+        positions = np.flatnonzero(changed)
+        deltas.append([positions.tolist(), to_list(quantized[i][positions])])
+    return keyframe, deltas
+
+def choropleth_payload(data, column):
+    """
+    Everything the browser needs to draw the animated map for one column:
+    the base figure (no frames) plus the delta encoded frames.
+    """
+    dates, locations, matrix = choropleth_value_matrix(data, column)
+    keyframe, deltas = delta_encode_frames(matrix)
+    # Upper end of the color scale, a few outliers should not wash out the whole map
+    zmax = float(np.nanpercentile(matrix, 99))
+
+    fig = go.Figure(data=[go.Choropleth(locations=locations,
+                                        zmin=0,
+                                        zmax=zmax,
+                                        colorscale="Reds",
+                                        colorbar_title="Per Million")])
+    fig.update_layout(geo=dict(showframe=False, projection_type="natural earth"),
+                      paper_bgcolor="rgba(0,0,0,0.05)",
+                      plot_bgcolor="rgba(0,0,0,0.05)",
+                      template = "seaborn",
+                      margin=dict(l=30,r=30,t=30,b=30))
+    return {"figure": fig.to_dict(),
+            "dates": dates,
+            "scale": CHOROPLETH_SCALE,
+            "keyframe": keyframe,
+            "deltas": deltas}
+
+# Precomputed once for both dropdown choices, the callback just picks one
+choropleth_payloads = {column: choropleth_payload(df, column)
+                       for column in ["Cases Per Million", "Deaths Per Million"]}
+
+
+# **`World map` along with the callbacks**
+
+# In[ ]:
+
+
+# 19: Adding a row with the world map, the payload is kept in the browser (dcc.Store)
+comp_19_choropleth_map = dbc.Row([
+    dbc.Col([dcc.Store(id="choropleth_payload"),
+             dcc.Graph(id="choropleth_daily_reported_numbers",
+                       style={"height": "600px"})],
+            className=["mt-2","mb-2"])])
+
+@app.callback(
+    Output("choropleth_payload", "data"),
+    [Input("choice_top_dropdown_cases_deaths_column", "value")])
+def choropleth_by_countries(choice_top_dropdown_cases_deaths_column):
+    return choropleth_payloads[choice_top_dropdown_cases_deaths_column]
+
+# Frames are decoded in the browser, see assets/choropleth.js
+app.clientside_callback(
+    ClientsideFunction(namespace="choropleth", function_name="build_figure"),
+    Output("choropleth_daily_reported_numbers", "figure"),
+    [Input("choropleth_payload", "data")])
+
+
+# *************
+# ### BLOCK 6
 # * Thanks, acknowledgements, reference request, contact etc....!
 #
 # **`Thanks` and acknowledgements.**
@@ -623,11 +1035,142 @@ html_comp_container = dbc.Container([comp_1_title_logo,
                                      comp_14_county_line_plots,
                                      comp_15_sub_title_country_cumsum_line_plot,
                                      comp_16_country_cumsum_line_plot,
+                                     comp_20_export_selection,
+                                     comp_18_main_header_choropleth,
+                                     comp_19_choropleth_map,
                                      comp_17_thanks_Acknowledgements])
 layout = html.Div([html_comp_container])
 app.layout = layout
 
 
+# *************
+# *************
+# # Memory accounting
+# * Deep size (in bytes) of the data, all the derived continent frames and the precomputed figures/payloads.
+# * Printed at startup and served from `/debug/memory` (with DASH_DEBUG_ROUTES=1), every call keeps a
+#   snapshot, so the growth between two calls (e.g. before and after a data refresh) shows which object is leaking.
+
+# In[ ]:
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Returns the deep size of obj in bytes.
+    DataFrames/Series use pandas memory_usage(deep=True), numpy arrays their buffer size,
+    containers (dict, list, tuple, set) are walked recursively, each object is counted only once.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, (pd.Series, pd.Index)):
+        return int(obj.memory_usage(deep=True))
+    if isinstance(obj, np.ndarray):
+        # getsizeof includes the buffer of an array owning its data, a view only
+        # has the header ==> the buffer is counted (once) through its base
+        size = sys.getsizeof(obj)
+        if obj.base is not None:
+            size += deep_sizeof(obj.base, seen)
+        return size
+    if isinstance(obj, go.Figure):
+        return deep_sizeof(obj.to_dict(), seen)
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        size += sum(deep_sizeof(v, seen) for v in obj)
+    elif hasattr(obj, "__dict__"):
+        size += deep_sizeof(vars(obj), seen)
+    return size
+
+def memory_tracked_objects():
+    """
+    Objects kept in memory by the dashboard, name ==> object.
+    Looked up on every call, so the objects rebuilt by a refresh are the ones measured.
+    """
+    return {"df": df,
+            "continent_store": continent_store,
+            "choropleth_payloads": choropleth_payloads}
+
+# Other caches kept in memory, name ==> function returning their size in bytes.
+# e.g. ../host.py registers its shared callback response cache here when it mounts the dashboard.
+memory_reporters = {}
+
+# Payloads sent to the browser, measured by their JSON size (what goes over the wire).
+# They never change after startup, so they are serialized only once.
+memory_serialized_sizes = {
+    "choropleth_payloads['{}']".format(column): len(json.dumps(payload, cls=plotly.utils.PlotlyJSONEncoder))
+    for column, payload in choropleth_payloads.items()}
+
+def max_rss_bytes():
+    """
+    Peak resident memory of the process (None when not available, e.g. on Windows)
+    """
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kilobytes on linux
+    except ImportError:
+        return None
+
+# Last 50 snapshots, the first one (startup) is kept separately as the baseline
+memory_snapshots = deque(maxlen=50)
+memory_baseline = {}
+
+def memory_report():
+    """
+    Takes a new memory snapshot and returns it along with the growth since the previous
+    snapshot and since startup, all sizes are in bytes.
+    """
+    objects = {name: deep_sizeof(obj) for name, obj in memory_tracked_objects().items()}
+    objects.update({name: reporter() for name, reporter in memory_reporters.items()})
+    # The cached country figures are on disk (shared by the workers), not part of the total
+    cache_stats = country_figures_cache.stats()
+    on_disk = {"country_figures_cache": cache_stats["bytes"]} if "bytes" in cache_stats else {}
+    serialized = dict(memory_serialized_sizes)
+    snapshot = {"time": datetime.now().isoformat(timespec="seconds"),
+                "objects": objects,
+                "serialized": serialized,
+                "on_disk": on_disk,
+                "total": sum(objects.values()),
+                "max_rss": max_rss_bytes()}
+
+    previous = memory_snapshots[-1] if memory_snapshots else snapshot
+    if not memory_baseline:
+        memory_baseline.update(snapshot)
+    snapshot["growth_since_last"] = {name: size - previous["objects"].get(name, 0)
+                                     for name, size in objects.items()}
+    snapshot["growth_since_startup"] = {name: size - memory_baseline["objects"].get(name, 0)
+                                        for name, size in objects.items()}
+    memory_snapshots.append(snapshot)
+    return snapshot
+
+def print_memory_report(snapshot):
+    print("Memory report ({}):".format(snapshot["time"]))
+    for name, size in sorted(snapshot["objects"].items(), key=lambda item: -item[1]):
+        print("    {:<45} {:>10.2f} MB  (growth since startup {:+.2f} MB)".format(
+            name, size/1e6, snapshot["growth_since_startup"][name]/1e6))
+    for name, size in snapshot["serialized"].items():
+        print("    {:<45} {:>10.2f} MB  (serialized JSON)".format(name, size/1e6))
+    for name, size in snapshot["on_disk"].items():
+        print("    {:<45} {:>10.2f} MB  (on disk)".format(name, size/1e6))
+    print("    {:<45} {:>10.2f} MB".format("Total", snapshot["total"]/1e6))
+    if snapshot["max_rss"] is not None:
+        print("    {:<45} {:>10.2f} MB".format("Process peak RSS", snapshot["max_rss"]/1e6))
+
+# Debug route, the report as JSON (opt-in, every call walks all the objects)
+if debug_routes:
+    @server.route("/debug/memory")
+    def debug_memory():
+        return jsonify(memory_report())
+
+print_memory_report(memory_report())
+
+
 # # The main
 
 # In[22]:
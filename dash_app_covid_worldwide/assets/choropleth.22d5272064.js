@@ -0,0 +1,60 @@
+// Rebuilds the animated world map from the delta encoded payload sent by the
+// `choropleth_by_countries` callback in app.py.
+//   payload.keyframe  ==> quantized values of all countries on the first date
+//   payload.deltas[i] ==> [changed positions, new values] for date i+1
+// Quantized values are divided by payload.scale to get the per million numbers back.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    choropleth: {
+        build_figure: function(payload) {
+            if (!payload) {
+                return window.dash_clientside.no_update;
+            }
+            var scale = payload.scale;
+            var current = payload.keyframe.slice();
+            var frames = [];
+            var steps = [];
+            for (var i = 0; i < payload.dates.length; i++) {
+                if (i > 0) {
+                    var positions = payload.deltas[i - 1][0];
+                    var values = payload.deltas[i - 1][1];
+                    for (var j = 0; j < positions.length; j++) {
+                        current[positions[j]] = values[j];
+                    }
+                }
+                var z = current.map(function(v) { return v === null ? null : v / scale; });
+                frames.push({name: payload.dates[i], data: [{z: z}]});
+                steps.push({label: payload.dates[i],
+                            method: "animate",
+                            args: [[payload.dates[i]],
+                                   {mode: "immediate",
+                                    frame: {duration: 0, redraw: true},
+                                    transition: {duration: 0}}]});
+            }
+
+            var figure = JSON.parse(JSON.stringify(payload.figure));
+            var last = frames.length - 1;
+            // Starting on the latest date
+            figure.data[0].z = frames[last].data[0].z;
+            figure.frames = frames;
+            figure.layout.sliders = [{active: last,
+                                      currentvalue: {prefix: "Date: "},
+                                      pad: {t: 30},
+                                      steps: steps}];
+            figure.layout.updatemenus = [{type: "buttons",
+                                          showactive: false,
+                                          x: 0.05, y: 0, xanchor: "right", yanchor: "top",
+                                          pad: {t: 45, r: 10},
+                                          buttons: [{label: "Play",
+                                                     method: "animate",
+                                                     args: [null, {fromcurrent: true,
+                                                                   frame: {duration: 100, redraw: true},
+                                                                   transition: {duration: 0}}]},
+                                                    {label: "Pause",
+                                                     method: "animate",
+                                                     args: [[null], {mode: "immediate",
+                                                                     frame: {duration: 0, redraw: false},
+                                                                     transition: {duration: 0}}]}]}];
+            return figure;
+        }
+    }
+});
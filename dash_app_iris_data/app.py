@@ -12,12 +12,16 @@
 
 #Deployed on heroku: https://iris-sci-acd-01.herokuapp.com/
 
+import re # regular expression
 import numpy as np
 import pandas as pd
 import plotly.express as px
+import plotly.graph_objects as go
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
+from dash.dependencies import Input, Output
+from fingerprinted_assets import serve_fingerprinted_assets
 
 #############################################################################################################
 # I am reading iris dataset from my git repo of datasets
@@ -28,12 +32,15 @@ iris_df.drop(['Species', 'NoNeed'], axis=1, inplace = True)#.head(2)
 
 #############################################################################################################
 # Style sheet and app initilization
-external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
+# The style sheet (a copy of https://codepen.io/chriddyp/pen/bWLwgP.css) is loaded from assets/ by Dash
+app = dash.Dash(__name__)
 
 # Activate the line below for cloud deployment
 server = app.server
 
+# Self-hosted assets, see ../build_assets.py, asset_url("Logo_SA.png") ==> URL of "Logo_SA.9b28b1810c.png"
+asset_url = serve_fingerprinted_assets(app)
+
 #############################################################################################################
 # Plotly plots for the dashboard
 scatter_1 = px.scatter(
@@ -69,53 +76,218 @@ scatter_2 = px.scatter(data_frame=iris_df,
 
            title="sepal width (cm) vs petal width (cm) color-encoded by flower type")
 
+#############################################################################################################
+# Linked brushing: selecting points in a scatter plot (graph1/graph2) filters the other four plots.
+# Everything the callback needs is precomputed once, the selection becomes a boolean mask over the rows
+# and the plots are re-aggregated with numpy (no plotly express on a filtered DataFrame).
+scatter_1.update_layout(dragmode="select")
+scatter_2.update_layout(dragmode="select")
+
+# Numeric features (we don't need Id column) as a numpy array, one column per feature
+feature_columns = list(iris_df.drop(['Id'], axis = 1).select_dtypes("number").columns)
+features = iris_df[feature_columns].values
+
+# Flower name of each row as an integer code ==> counts by flower are a single np.bincount
+flower_codes, flower_names = pd.factorize(iris_df.FlowerName)
+flower_rows = {name: np.flatnonzero(flower_codes == code) for code, name in enumerate(flower_names)}
+# Same colors as the scatter plots
+flower_colors = {trace.name: trace.marker.color for trace in scatter_1.data}
+
+# px.scatter creates one trace per flower, selectedData gives (curveNumber, pointIndex) of each point.
+# All the rows of the traces in one flat array, row of a point ==> trace_rows[trace_offsets[curve] + point]
+trace_rows = np.concatenate([flower_rows[trace.name] for trace in scatter_1.data])
+trace_offsets = np.cumsum([0] + [len(flower_rows[trace.name]) for trace in scatter_1.data])
+
+# Histogram bins of sepal length are fixed, bin of each row is computed only once
+hist_bin_edges = np.histogram_bin_edges(iris_df.SepalLengthCm.values, bins="auto")
+hist_bins = np.clip(np.digitize(iris_df.SepalLengthCm.values, hist_bin_edges) - 1, 0, len(hist_bin_edges) - 2)
+hist_bin_centers = (hist_bin_edges[:-1] + hist_bin_edges[1:]) / 2
+
+def selection_mask(*selections):
+    """
+    Boolean mask over the rows of iris_df, rows selected in all the given selectedData
+    (None, i.e. nothing selected, keeps all the rows)
+    """
+    mask = np.ones(len(iris_df), dtype=bool)
+    for selected in selections:
+        if not selected:
+            continue
+        curves = np.array([point["curveNumber"] for point in selected["points"]], dtype=int)
+        points = np.array([point["pointIndex"] for point in selected["points"]], dtype=int)
+        selected_mask = np.zeros(len(iris_df), dtype=bool)
+        selected_mask[trace_rows[trace_offsets[curves] + points]] = True
+        mask &= selected_mask
+    return mask
+
 #********************************
-hist_1 = px.histogram(data_frame=iris_df,
-             x="SepalLengthCm",
-             color="FlowerName",
-             title="Distributions of sepal length (cm) color-encoded by flower name")
+def histogram_figure(mask):
+    # counts of (flower, bin) pairs in one go
+    counts = np.bincount(flower_codes[mask] * len(hist_bin_centers) + hist_bins[mask],
+                         minlength=len(flower_names) * len(hist_bin_centers)).reshape(len(flower_names), -1)
+    fig = go.Figure([go.Bar(x=hist_bin_centers,
+                            y=counts[code],
+                            width=np.diff(hist_bin_edges),
+                            name=name,
+                            marker_color=flower_colors[name])
+                     for code, name in enumerate(flower_names)])
+    fig.update_layout(barmode="relative",
+                      xaxis_title="SepalLengthCm",
+                      yaxis_title="count",
+                      legend_title_text="FlowerName",
+                      title="Distributions of sepal length (cm) color-encoded by flower name")
+    return fig
 
 #********************************
-box_1 = px.box(data_frame=iris_df,
-           x="FlowerName",
-           y="SepalWidthCm",
-           color="FlowerName",
-           title="concentration of sepal width (cm) by flower types")
+sepal_width = iris_df.SepalWidthCm.values
+
+def box_figure(mask):
+    # Box statistics are computed here, only five numbers per flower (plus the outliers) are sent to the browser
+    fig = go.Figure()
+    for name, rows in flower_rows.items():
+        values = sepal_width[rows[mask[rows]]]
+        if len(values) == 0:
+            continue
+        q1, median, q3 = np.percentile(values, [25, 50, 75])
+        iqr = q3 - q1
+        inside = (values >= q1 - 1.5*iqr) & (values <= q3 + 1.5*iqr)
+        fig.add_trace(go.Box(x=[name],
+                             q1=[q1],
+                             median=[median],
+                             q3=[q3],
+                             lowerfence=[values[inside].min()],
+                             upperfence=[values[inside].max()],
+                             name=name,
+                             legendgroup=name,
+                             marker_color=flower_colors[name]))
+        # Outliers (outside the fences) as points, like px.box shows them
+        outliers = values[~inside]
+        fig.add_trace(go.Scatter(x=[name] * len(outliers),
+                                 y=outliers,
+                                 mode="markers",
+                                 name=name,
+                                 legendgroup=name,
+                                 showlegend=False,
+                                 marker_color=flower_colors[name]))
+    fig.update_layout(xaxis_title="FlowerName",
+                      yaxis_title="SepalWidthCm",
+                      title="concentration of sepal width (cm) by flower types")
+    return fig
 
 #********************************
-pie_1 = px.pie(
-    iris_df, names='FlowerName',
-    title="concentration of sepal width (cm) by flower types")
+def pie_figure(mask):
+    fig = go.Figure([go.Pie(labels=flower_names,
+                            values=np.bincount(flower_codes[mask], minlength=len(flower_names)),
+                            marker_colors=[flower_colors[name] for name in flower_names],
+                            sort=False)])
+    fig.update_layout(title="concentration of sepal width (cm) by flower types")
+    return fig
 
 #*******************************
-# For correlation heatmap, we need to do some extra stuf....!
-import re # regular expression
-# Let's get corr dataframe and yes, we don't need Id column, leave it for the moment..!
-df_corr = iris_df.drop(['Id'], axis = 1).corr()
-#df_corr = iris_df.corr()
-x=[]; y=[]
-for num in range(len(df_corr)):
-    #x.append(" ".join(re.findall('[A-Z][^A-Z]*', list(iris_df.corr().index)[num])[0:-1]))
-    #y.append(" ".join(re.findall('[A-Z][^A-Z]*', list(iris_df.corr().columns)[num])[0:-1]))
-    x.append(" ".join(re.findall('[A-Z][^A-Z]*', df_corr.index[num])[0:-1]))
-    y.append(" ".join(re.findall('[A-Z][^A-Z]*', df_corr.columns[num])[0:-1]))
-# The above block of the code was required here to
-
-heatmap_corr = px.imshow(df_corr,
-         labels={'x': 'Features', 'y': 'Features', 'color': 'Correlation'},
-         #labels=dict(x="Features", y="Features", color="Correlation"), # same as above line
-                   x=x,
-                   y=y,
-                   title = "Correlation Heatmap, this is just an example to show how to get such plots......!  "
-                  )
-#heatmap_corr.update_xaxes(side="top") # To change the x-axes label position
-heatmap_corr.update_layout(
-    title={
-        'text': 'Example Correlation Heatmap to show how to get such plots......! ',
-        'y':.90,
-        'x':0.5,
-        'xanchor': 'center',
-        'yanchor': 'top'})
+# For correlation heatmap, we keep running sums instead of calling .corr() on the full DataFrame.
+# Count, sums and co-moments (sums of cross products) can be added and subtracted, so appending rows
+# or selecting a subset only touches the new/selected rows and the matrix comes from (features x features) numbers.
+class CorrelationStats:
+    """
+    Sufficient statistics for the correlation matrix:
+        n     = number of rows
+        sums  = sum of (x - shift) for each feature
+        cross = sum of (x - shift)(x - shift)^T, features x features
+    shift is a fixed reference point (mean of the first rows) to avoid loss of precision.
+    """
+    def __init__(self, shift):
+        self.shift = np.asarray(shift, dtype=float)
+        self.n = 0
+        self.sums = np.zeros(len(self.shift))
+        self.cross = np.zeros((len(self.shift), len(self.shift)))
+
+    @classmethod
+    def from_rows(cls, rows, shift=None):
+        stats = cls(rows.mean(axis=0) if shift is None else shift)
+        return stats.append(rows)
+
+    def append(self, rows):
+        """Adds new rows (streaming measurements), cost is rows x features^2"""
+        centered = np.asarray(rows, dtype=float) - self.shift
+        self.n += len(centered)
+        self.sums += centered.sum(axis=0)
+        self.cross += centered.T @ centered
+        return self
+
+    def recentred(self, shift):
+        """Same statistics around another shift, (x - shift) = (x - self.shift) + (self.shift - shift)"""
+        stats = CorrelationStats(shift)
+        d = self.shift - stats.shift
+        stats.n = self.n
+        stats.sums = self.sums + self.n * d
+        stats.cross = self.cross + np.outer(self.sums, d) + np.outer(d, self.sums) + self.n * np.outer(d, d)
+        return stats
+
+    def __add__(self, other):
+        # The sums only combine around the same shift
+        if not np.array_equal(other.shift, self.shift):
+            other = other.recentred(self.shift)
+        stats = CorrelationStats(self.shift)
+        stats.n, stats.sums, stats.cross = self.n + other.n, self.sums + other.sums, self.cross + other.cross
+        return stats
+
+    def __sub__(self, other):
+        if not np.array_equal(other.shift, self.shift):
+            other = other.recentred(self.shift)
+        stats = CorrelationStats(self.shift)
+        stats.n, stats.sums, stats.cross = self.n - other.n, self.sums - other.sums, self.cross - other.cross
+        return stats
+
+    def corr(self):
+        """Correlation matrix from the running sums only (NaN with less than two rows)"""
+        if self.n < 2:
+            return np.full(self.cross.shape, np.nan)
+        cov = self.cross - np.outer(self.sums, self.sums) / self.n
+        std = np.sqrt(np.diag(cov))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.clip(cov / np.outer(std, std), -1, 1)
+
+# Statistics of all the rows, computed once
+corr_stats_all = CorrelationStats.from_rows(features)
+
+def selection_corr_stats(mask):
+    """
+    Statistics of the selected rows, only the smaller of the selection and
+    its complement is visited (all rows selected ==> nothing to visit)
+    """
+    selected = mask.sum()
+    if selected == len(mask):
+        return corr_stats_all
+    if selected <= len(mask) / 2:
+        return CorrelationStats.from_rows(features[mask], corr_stats_all.shift)
+    return corr_stats_all - CorrelationStats.from_rows(features[~mask], corr_stats_all.shift)
+
+# Axis labels, e.g. "SepalLengthCm" ==> "Sepal Length", the "Cm" part is dropped
+feature_labels = [" ".join(re.findall('[A-Z][^A-Z]*', column)[0:-1]) for column in feature_columns]
+
+def heatmap_figure(mask):
+    fig = go.Figure([go.Heatmap(z=selection_corr_stats(mask).corr(),
+                                x=feature_labels,
+                                y=feature_labels,
+                                zmin=-1,
+                                zmax=1,
+                                colorbar_title="Correlation")])
+    fig.update_layout(xaxis_title="Features",
+                      yaxis_title="Features",
+                      yaxis_autorange="reversed",
+                      title={
+                          'text': 'Example Correlation Heatmap to show how to get such plots......! ',
+                          'y':.90,
+                          'x':0.5,
+                          'xanchor': 'center',
+                          'yanchor': 'top'})
+    return fig
+
+# Figures with all the rows for the initial layout
+all_rows = selection_mask()
+hist_1 = histogram_figure(all_rows)
+box_1 = box_figure(all_rows)
+pie_1 = pie_figure(all_rows)
+heatmap_corr = heatmap_figure(all_rows)
 
 #############################################################################################################
 # Embedding plots into dcc components
@@ -134,7 +306,7 @@ graph6 = dcc.Graph(id='graph6', figure=heatmap_corr, className="six columns")#"n
 # Creating html components/layout for our dashboard
 # Adding Company Logo
 comp_logo = html.A([html.Img(
-    src='/assets/Logo_SA.png',
+    src=asset_url('Logo_SA.png'),
     style={
         'height' : '15%',
         'width' : '15%',
@@ -205,6 +377,19 @@ layout = html.Div(
 # We need to set layout as the layout of the dashboard app, already initialized above in the beginning.
 app.layout = layout
 
+#############################################################################################################
+# Callback for linked brushing, selection in graph1 and/or graph2 filters graph3 to graph6
+@app.callback(
+    [Output('graph3', 'figure'),
+     Output('graph4', 'figure'),
+     Output('graph5', 'figure'),
+     Output('graph6', 'figure')],
+    [Input('graph1', 'selectedData'),
+     Input('graph2', 'selectedData')])
+def cross_filter_by_selection(selected_graph1, selected_graph2):
+    mask = selection_mask(selected_graph1, selected_graph2)
+    return histogram_figure(mask), box_figure(mask), pie_figure(mask), heatmap_figure(mask)
+
 #############################################################################################################
 # Our main function for python .py file
 if __name__ == "__main__":
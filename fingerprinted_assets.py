@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Serving the fingerprinted assets of a dashboard
+# The files in `assets/` are written by build_assets.py, they have the hash of their content in the name and
+# `assets/manifest.json` maps the original names to them, e.g. "Logo_SA.png" ==> "Logo_SA.9b28b1810c.png".
+#
+# * Fingerprinted files never change ==> cached by the browsers for a year.
+# * The precompressed .br/.gz copy is sent when the browser accepts it.
+#
+# The file at the root of the repository is the one to edit, build_assets.py copies it next to the app.py
+# of every dashboard (each dashboard is also deployed on its own).
+#
+# Usage in app.py:
+#     from fingerprinted_assets import serve_fingerprinted_assets
+#     app = dash.Dash(__name__)
+#     asset_url = serve_fingerprinted_assets(app)
+#     ... html.Img(src=asset_url("Logo_SA.png")) ...
+
+import os
+import re
+import json
+import mimetypes
+
+from flask import request, send_from_directory
+
+FINGERPRINTED = re.compile(r"\.[0-9a-f]{10}\.\w+$")
+
+def load_manifest(assets_folder):
+    """Original name ==> fingerprinted name, empty when the assets are not built"""
+    try:
+        with open(os.path.join(assets_folder, "manifest.json")) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return {}
+
+def serve_fingerprinted_assets(app):
+    """
+    Adds the request hooks sending the precompressed copies and the cache header to the Flask server
+    of the Dash app, returns asset_url(name), the URL of the fingerprinted copy of an asset.
+    """
+    assets_folder = app.config.assets_folder
+    asset_manifest = load_manifest(assets_folder)
+    assets_route = app.config.routes_pathname_prefix + app.config.assets_url_path.strip("/") + "/"
+
+    def requested_fingerprinted_asset():
+        if request.path.startswith(assets_route) and FINGERPRINTED.search(request.path):
+            return request.path[len(assets_route):]
+        return None
+
+    @app.server.before_request
+    def send_precompressed_asset():
+        name = requested_fingerprinted_asset()
+        if name is None:
+            return None
+        # quality of the encoding in Accept-Encoding, 0 when it is missing or refused (q=0)
+        for encoding, extension in [("br", ".br"), ("gzip", ".gz")]:
+            if request.accept_encodings[encoding] > 0 and os.path.isfile(os.path.join(assets_folder, name + extension)):
+                response = send_from_directory(assets_folder, name + extension,
+                                               mimetype=mimetypes.guess_type(name)[0])
+                response.headers["Content-Encoding"] = encoding
+                response.headers["Vary"] = "Accept-Encoding"
+                return response
+        return None
+
+    @app.server.after_request
+    def cache_fingerprinted_asset(response):
+        if requested_fingerprinted_asset() is not None and response.status_code == 200:
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        return response
+
+    def asset_url(name):
+        """URL of the fingerprinted copy of an asset"""
+        return app.get_asset_url(asset_manifest.get(name, name))
+
+    return asset_url
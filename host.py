@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # Hosting all the dashboards in a single process
+# Instead of deploying every dashboard as a separate app (each with its own `server = app.server`, gunicorn
+# workers, imports and caches), this entry point mounts all of them under one WSGI server with path prefixes:
+#
+# * http://localhost:8050/covid/ ==> dash_app_covid_worldwide/app.py
+# * http://localhost:8050/iris/  ==> dash_app_iris_data/app.py
+#
+# All the dashboards share the worker pool, one copy of pandas/plotly/dash in memory and one bounded
+# cache of the callback responses (for the dashboards that opt in). A new dashboard built from these
+# templates is mounted by adding one line to `DASHBOARDS` below.
+#
+# Behind a reverse proxy, DASH_REQUESTS_PATHNAME_PREFIX (e.g. "/dashboards/") is kept as the base of
+# all the prefixes, e.g. "/dashboards/covid/".
+#
+# Run locally: `python host.py`, deploy: `gunicorn host:server` (see Procfile).
+
+import os
+import io
+import sys
+import hashlib
+import threading
+import importlib.util
+from collections import OrderedDict
+
+from flask import Flask, render_template_string
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+#############################################################################################################
+# Dashboards to mount, path prefix ==> (app.py of the dashboard relative to this file, cache_callbacks)
+#
+# cache_callbacks=True keeps the callback responses of the dashboard in the shared cache. This is only
+# correct when the callbacks are pure, i.e. the same inputs always give the same response: the data is
+# read once at startup and the callbacks don't depend on the time, random numbers, the user/session or
+# live data. Leave it False for any dashboard where that is not true, and for the dashboards with their own
+# cache: the CoVID dashboard keeps the country figures in a SQLite cache shared by all the workers, whose
+# hit rate (/debug/cache) is used to tune its size. Answering its callbacks here would hide that demand.
+DASHBOARDS = OrderedDict([
+    ("/covid", ("dash_app_covid_worldwide/app.py", False)),
+    ("/iris", ("dash_app_iris_data/app.py", True))])
+
+# Upper limit for the shared callback response cache (in bytes)
+CACHE_MAX_BYTES = int(os.environ.get("DASH_HOST_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+#############################################################################################################
+def load_dashboard(prefix, path):
+    """
+    Imports the app.py of a dashboard as its own module and returns the module.
+    Dash reads DASH_REQUESTS_PATHNAME_PREFIX when the app is created, so the browser sends
+    all the requests (layout, callbacks, assets) under the prefix of the dashboard.
+    A prefix already set by the operator is used as the base and restored afterwards.
+    """
+    module_name = "dashboard_" + prefix.strip("/")
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(os.path.dirname(os.path.abspath(__file__)), path))
+    module = importlib.util.module_from_spec(spec)
+    # Dash finds the assets folder of the app through sys.modules
+    sys.modules[module_name] = module
+    base_prefix = os.environ.get("DASH_REQUESTS_PATHNAME_PREFIX")
+    os.environ["DASH_REQUESTS_PATHNAME_PREFIX"] = (base_prefix or "/").rstrip("/") + prefix + "/"
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        if base_prefix is None:
+            del os.environ["DASH_REQUESTS_PATHNAME_PREFIX"]
+        else:
+            os.environ["DASH_REQUESTS_PATHNAME_PREFIX"] = base_prefix
+    return module
+
+#############################################################################################################
+class CallbackResponseCache:
+    """
+    WSGI middleware, keeps the responses of the Dash callbacks (POST .../_dash-update-component)
+    of the dashboards mounted on cached_prefixes in one LRU cache bounded by size in bytes.
+    Those dashboards have pure callbacks (see DASHBOARDS), so the same callback inputs always give
+    the same response and the repeated selections are served without running the callback again.
+    """
+    def __init__(self, wsgi_app, max_bytes, cached_prefixes):
+        self.wsgi_app = wsgi_app
+        self.max_bytes = max_bytes
+        self.cached_prefixes = tuple(prefix + "/" for prefix in cached_prefixes)
+        self.entries = OrderedDict() # key ==> (status, headers, body)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO", "")
+        if (environ["REQUEST_METHOD"] != "POST"
+                or not path.endswith("/_dash-update-component")
+                or not path.startswith(self.cached_prefixes)):
+            return self.wsgi_app(environ, start_response)
+
+        body = environ["wsgi.input"].read(int(environ.get("CONTENT_LENGTH") or 0))
+        environ["wsgi.input"] = io.BytesIO(body)
+        # Responses may be compressed, so the accepted encoding is part of the key
+        key = hashlib.sha1(b"\n".join([environ["PATH_INFO"].encode(),
+                                       environ.get("HTTP_ACCEPT_ENCODING", "").encode(),
+                                       body])).hexdigest()
+        with self.lock:
+            cached = self.entries.get(key)
+            if cached is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if cached is not None:
+            status, headers, data = cached
+            start_response(status, headers)
+            return [data]
+
+        captured = {}
+        def capture_start_response(status, headers, exc_info=None):
+            captured["status"], captured["headers"] = status, headers
+            return start_response(status, headers, exc_info)
+
+        response = self.wsgi_app(environ, capture_start_response)
+        try:
+            data = b"".join(response)
+        finally:
+            if hasattr(response, "close"):
+                response.close()
+        if captured.get("status", "").startswith("200"):
+            self.store(key, (captured["status"], captured["headers"], data))
+        return [data]
+
+    def store(self, key, entry):
+        if len(entry[2]) > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = entry
+            self.size += len(entry[2])
+            while self.size > self.max_bytes:
+                _, (_, _, data) = self.entries.popitem(last=False) # least recently used
+                self.size -= len(data)
+
+#############################################################################################################
+# Landing page with the links to all the dashboards
+root = Flask(__name__)
+
+@root.route("/")
+def index():
+    return render_template_string(
+        "<h1>Dashboards</h1><ul>{% for prefix in prefixes %}"
+        "<li><a href='{{ prefix.strip('/') }}/'>{{ prefix.strip('/') }}</a></li>{% endfor %}</ul>",
+        prefixes=DASHBOARDS.keys())
+
+@root.route("/cache-stats")
+def cache_stats():
+    return {"entries": len(server.entries),
+            "bytes": server.size,
+            "max_bytes": server.max_bytes,
+            "hits": server.hits,
+            "misses": server.misses}
+
+dashboard_modules = {prefix: load_dashboard(prefix, path) for prefix, (path, _) in DASHBOARDS.items()}
+dash_apps = {prefix: module.app for prefix, module in dashboard_modules.items()}
+
+# Size of the shared cache in the memory report of the dashboards that have one (see memory_reporters)
+for module in dashboard_modules.values():
+    if hasattr(module, "memory_reporters"):
+        module.memory_reporters["host callback response cache (shared)"] = lambda: server.size
+
+# The WSGI server for gunicorn
+server = CallbackResponseCache(
+    DispatcherMiddleware(root, {prefix: dash_app.server for prefix, dash_app in dash_apps.items()}),
+    CACHE_MAX_BYTES,
+    cached_prefixes=[prefix for prefix, (_, cache_callbacks) in DASHBOARDS.items() if cache_callbacks])
+
+#############################################################################################################
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    run_simple("localhost", 8050, server, threaded=True)